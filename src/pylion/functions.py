@@ -31,9 +31,10 @@ def placeions(ions, positions):
     >>> placeions(ions, positions)
 
     :param ions: dict with keys 'charge', 'mass'
-    :param positions: list of (x, y , z) coodrinates of each ion
+    :param positions: list or (N, 3) array of (x, y , z) coodrinates of each ion
     """
 
+    positions = np.ascontiguousarray(positions, dtype=np.float64)
     ions.update({"positions": positions})
 
     return ions
@@ -52,16 +53,17 @@ def createioncloud(ions, radius, number):
     :param number: number of atoms
     """
 
-    positions = []
+    # one row of random numbers per ion keeps the same order of draws as
+    # sampling (d, a, b) ion by ion
+    d, a, b = np.random.random((number, 3)).T
+    d = d * radius
+    a = np.pi * a
+    b = 2 * np.pi * b
 
-    for ind in range(number):
-        d = np.random.random() * radius
-        a = np.pi * np.random.random()
-        b = 2 * np.pi * np.random.random()
-
-        positions.append(
-            [d * np.sin(a) * np.cos(b), d * np.sin(a) * np.sin(b), d * np.cos(a)]
-        )
+    positions = np.empty((number, 3))
+    positions[:, 0] = d * np.sin(a) * np.cos(b)
+    positions[:, 1] = d * np.sin(a) * np.sin(b)
+    positions[:, 2] = d * np.cos(a)
 
     ions.update({"positions": positions})
 
@@ -474,7 +476,7 @@ def dump(uid, filename, variables, steps=10, group="all"):
 
     lines.append(f"dump {uid} {group} custom {steps:d} {filename} id {names}\n")
 
-    return {"code": lines}
+    return {"code": lines, "output_files": [filename]}
 
 
 def trapaqtovoltage(ions, trap, a, q):
@@ -497,9 +499,24 @@ def trapaqtovoltage(ions, trap, a, q):
 
 
 def check_particles_in_domain(particles, domain):
-    particles = np.asarray(particles)
-    domain = np.asarray(domain)
-    return bool(np.all(np.abs(particles) < domain))
+    """Checks that all particles lie inside the simulation box, which
+    extends from -domain to domain along each axis.
+
+    :param particles: (N, 3) array of (x, y, z) coordinates
+    :param domain: (x, y, z) half-widths of the simulation box
+    :return: True if all particles are inside the domain
+    """
+
+    particles = np.asarray(particles, dtype=np.float64)
+    if particles.size == 0:
+        return True
+    if particles.ndim != 2 or particles.shape[1] != 3:
+        raise ValueError(
+            f"Positions should have shape (N, 3), got {particles.shape} instead."
+        )
+
+    domain = np.asarray(domain, dtype=np.float64)
+    return bool((np.abs(particles) < domain).all())
 
 
 def readdump(filename):
@@ -28,7 +28,7 @@ class CfgObject:
         func = self.func
 
         if getattr(self, "_unique_id", False):
-            uid = _unique_id(func, *args)
+            uid = _unique_id(func, args, kwargs)
             self.odict["uid"] = uid
             func = functools.partial(self.func, uid)
 
@@ -43,20 +43,21 @@ class Ions(CfgObject):
     # need to handle this in the class namespace
     # I'm not sure if this is necessary for all versions of lammps
     # If not I could handle the ions uid just like any other fix
-    _ids = set()
+    # maps the hash of each ions definition to its sequential uid
+    _ids = {}
 
     def __call__(self, *args, **kwargs):
         self.odict = super().__call__(*args, **kwargs)
 
-        # if function, charge, mass and rigid are the same it's probably the
-        # same ions definition. Don't increment the set count.
+        # if function, charge, mass, rigid and positions are the same it's the
+        # same ions definition. Don't increment the count. Different groups
+        # of the same species still get their own uid.
         charge, mass = self.odict["charge"], self.odict["mass"]
         rigid = self.odict.get("rigid", False)
+        positions = self.odict["positions"]
 
-        uid = _unique_id(self.func, charge, mass, rigid)
-        Ions._ids.add(uid)
-
-        self.odict["uid"] = len(Ions._ids)
+        uid = _unique_id(self.func, charge, mass, rigid, positions)
+        self.odict["uid"] = Ions._ids.setdefault(uid, len(Ions._ids) + 1)
 
         return self.odict.copy()
 
@@ -2,18 +2,50 @@ import json
 import os
 import shutil
 import subprocess
-from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
 
 import h5py
 import jinja2 as j2
+import numpy as np
 
 from . import utils
 from ._version import __version__
 from .functions import check_particles_in_domain
 
 
+def _bytecode_cache():
+    # compiled template bytecode is also cached on disk so that every new
+    # python process running a simulation does not have to parse the template
+    # again. Without a directory jinja2 uses a private per-user folder and
+    # refuses to use it if it is not safe. The cache is only an optimisation
+    # so run without it rather than failing to import
+    try:
+        return j2.FileSystemBytecodeCache()
+    except (OSError, RuntimeError):
+        return None
+
+
+# templates ship with the package and don't change at runtime so a single
+# environment is enough and jinja2 caches the compiled templates by name
+_JINJA_ENV = j2.Environment(
+    loader=j2.PackageLoader("pylion", "templates"),
+    trim_blocks=True,
+    auto_reload=False,
+    cache_size=-1,
+    bytecode_cache=_bytecode_cache(),
+)
+
+
+def _create_atoms(uid, positions):
+    # format all create_atoms commands of a species in one go rather than
+    # looping over every position in the template. The positions have been
+    # validated by check_particles_in_domain already
+    positions = np.asarray(positions, dtype=np.float64)
+    line = f"create_atoms {uid} single %r %r %r units box"
+    return "\n".join([line % tuple(position) for position in positions.tolist()])
+
+
 class SimulationError(Exception):
     """Custom error class for Simulation."""
 
@@ -23,13 +55,26 @@ class SimulationError(Exception):
 class Attributes(dict):
     """Light dict wrapper to serve as a container of attributes."""
 
+    # name of the dataset holding the json serialised attributes
+    _dataset = "_attrs_json"
+
     def save(self, filename):
-        with h5py.File(filename, "a") as f:
-            print(f"Saving attributes to {filename}")
-            f.attrs.update({k: json.dumps(v) for k, v in self.items()})
+        """Save the attributes to an h5 file given its name or open handle."""
+
+        # a single dataset avoids an object header update per key and the
+        # 64kB size limit of h5 attributes
+        data = np.frombuffer(json.dumps(dict(self)).encode(), dtype="u1")
+        with utils._h5open(filename) as f:
+            print(f"Saving attributes to {f.file.filename}")
+            if self._dataset in f:
+                del f[self._dataset]
+            f.create_dataset(self._dataset, data=data, compression="gzip")
 
     def load(self, filename):
-        with h5py.File(filename, "r") as f:
+        with utils._h5open(filename, "r") as f:
+            if self._dataset in f:
+                return json.loads(f[self._dataset][()].tobytes())
+            # files written by older versions store one h5 attribute per key
             return {k: json.loads(v) for k, v in f.attrs.items()}
 
 
@@ -38,7 +83,9 @@ class Simulation(list):
         super().__init__()
 
         # keep track of uids for list function overrides
-        self._uids = []
+        # maps each uid to the index it was first appended at
+        self._uids = {}
+        self._duplicate_uids = False
 
         # slugify 'name' to use for filename
         name = name.replace(" ", "_").lower()
@@ -81,33 +128,46 @@ class Simulation(list):
         if not isinstance(this, dict):
             raise SimulationError("Only 'dicts' are allowed in Simulation().")
 
-        self._uids.append(this.get("uid"))
+        get = this.get
+        attrs = self.attrs
+
+        uid = get("uid")
+        if uid is not None:
+            if uid in self._uids:
+                self._duplicate_uids = True
+            else:
+                self._uids[uid] = len(self)
 
         # ions will always be included first so to sort you have
         # to give 1-count 'priority' keys to the rest
-        if this.get("type") == "ions":
+        if get("type") == "ions":
             this["priority"] = 0
-            if this.get("rigid"):
-                self.attrs["rigid"]["exists"] = True
-                self.attrs["rigid"].setdefault("groups", []).append(this["uid"])
+            if get("rigid"):
+                rigid = attrs["rigid"]
+                rigid["exists"] = True
+                rigid.setdefault("groups", []).append(uid)
 
-        timestep = this.get("timestep", 1e12)
-        if timestep < self.attrs["timestep"]:
+        timestep = get("timestep")
+        if timestep is not None and timestep < attrs["timestep"]:
             print(f"Reducing timestep to {timestep} sec")
-            self.attrs["timestep"] = timestep
+            attrs["timestep"] = timestep
 
-        super().append(this)
+        list.append(self, this)
 
     def extend(self, iterable):
         """Calls ``append`` on an iterable."""
 
+        append = self.append
         for item in iterable:
-            self.append(item)
+            append(item)
 
     def index(self, this):
         """Returns the index of an item using its ``uid``."""
 
-        return self._uids.index(this["uid"])
+        try:
+            return self._uids[this["uid"]]
+        except KeyError:
+            raise ValueError(f"{this['uid']} is not in Simulation") from None
 
     def remove(self, this):
         """Will not remove anything from the simulation but rather from lammps.
@@ -131,63 +191,93 @@ class Simulation(list):
     def _writeinputfile(self):
         self.sort()  # if 'priority' keys exist
 
-        odict = defaultdict(list)
-        # deal the items in odict
-        for item in self:
-            if item.get("type") == "ions":
-                odict["species"].append(item)
-            else:
-                odict["simulation"].append(item)
-
         # do a couple of checks
         # check for uids clashing
-        uids = [uid for uid in self._uids if uid is not None]
-        if len(uids) > len(set(uids)):
+        if self._duplicate_uids:
             raise SimulationError(
                 "There are identical 'uids'. Although this is allowed in some "
                 " cases, 'lammps' is probably not going to like it."
             )
 
+        # deal the items in species and simulation and check the species in
+        # the same pass
+        species = []
+        simulation = []
+        create_atoms = {}
+        domain = tuple(self.attrs["domain"])
+        maxuid = 0
+        for item in self:
+            if item.get("type") != "ions":
+                simulation.append(item)
+                continue
+
+            species.append(item)
+            uid = item["uid"]
+            if uid > maxuid:
+                maxuid = uid
+
+            # check if ions are within the domain
+            positions = item["positions"]
+            if not check_particles_in_domain(positions, domain):
+                raise SimulationError(
+                    f"Ions are of species={uid} are placed outside the simulation domain."
+                )
+
+            create_atoms[uid] = _create_atoms(uid, positions)
+
+        if not species:
+            raise ValueError("There are no ions in the simulation.")
+
         # make sure species will behave
-        maxuid = max(odict["species"], key=lambda item: item["uid"])["uid"]
-        if maxuid > len(odict["species"]):
+        if maxuid > len(species):
             raise SimulationError(
                 f"Max 'uid' of species={maxuid} is larger than the number "
-                f"of species={len(odict['species'])}. "
+                f"of species={len(species)}. "
                 "Calling '@lammps.ions' decorated functions increments the "
                 "'uid' count unless it is for the same ion group."
             )
 
-        # check if ions are within the domain
-        for ion in odict["species"]:
-            if not check_particles_in_domain(ion["positions"], self.attrs["domain"]):
-                raise SimulationError(
-                    f"Ions are of species={ion['uid']} are placed outside the simulation domain."
-                )
-
         # load jinja2 template
-        env = j2.Environment(
-            loader=j2.PackageLoader("pylion", "templates"), trim_blocks=True
-        )
-        template = env.get_template(self.attrs["template"])
-        rendered = template.render({**self.attrs, **odict})
+        template = _JINJA_ENV.get_template(self.attrs["template"])
 
+        # stream the rendered template straight to the file rather than
+        # building the whole input script in memory first. The file is
+        # written in binary with a large buffer to keep the number of
+        # writes down for big ion clouds. Render to a temporary file first so
+        # an error half way through never leaves a truncated script behind
         filepath = Path(self.attrs["directory"], self.attrs["name"] + ".lammps")
-        with open(filepath, "w") as f:
-            f.write(rendered)
+        tmppath = filepath.with_name(filepath.name + ".tmp")
+        try:
+            with open(tmppath, "wb", buffering=1 << 20) as f:
+                template.stream(
+                    self.attrs,
+                    species=species,
+                    simulation=simulation,
+                    create_atoms=create_atoms,
+                ).dump(f, encoding="utf-8")
+            os.replace(tmppath, filepath)
+        except BaseException:
+            tmppath.unlink(missing_ok=True)
+            raise
 
         # get a few more attrs now that the lammps file is written
         # - simulation time
         self.attrs["time"] = datetime.now().isoformat()
 
         # - names of the output files
-        fixes = filter(lambda item: item.get("type") == "fix", odict["simulation"])
-        self.attrs["output_files"] = [
-            line.split()[5]
-            for fix in fixes
-            for line in fix["code"]
-            if line.startswith("dump")
-        ]
+        # fixes can declare them with an 'output_files' key, otherwise look
+        # for dump commands in their code
+        output_files = []
+        for fix in simulation:
+            if fix.get("type") != "fix":
+                continue
+            if "output_files" in fix:
+                output_files.extend(fix["output_files"])
+            else:
+                output_files.extend(
+                    line.split()[5] for line in fix["code"] if line.startswith("dump")
+                )
+        self.attrs["output_files"] = output_files
 
     def execute(self):
         """Write lammps input file and run the simulation."""
@@ -250,21 +340,19 @@ class Simulation(list):
     def _save_attributes_and_files(self):
         attrs = self.attrs
 
-        # initalise the h5 file
+        # initalise the h5 file and keep it open for all writes
         h5file = Path(attrs["directory"], attrs["name"] + ".h5")
-        with h5py.File(h5file, "w") as f:  # noqa: F841
-            pass
-
-        # save attrs and scripts to h5 file
-        attrs.save(h5file)
-        utils._savecallersource(h5file)
-
-        for filename in attrs["output_files"] + [
-            attrs["name"] + ".lmp.log",
-            attrs["name"] + ".lammps",
-        ]:
-            filepath = str(Path(attrs["directory"]) / filename)
-            utils._savescriptsource(h5file, filepath)
+        with h5py.File(h5file, "w", libver="latest") as f:
+            # save attrs and scripts to h5 file
+            attrs.save(f)
+            utils._savecallersource(f)
+
+            for filename in attrs["output_files"] + [
+                attrs["name"] + ".lmp.log",
+                attrs["name"] + ".lammps",
+            ]:
+                filepath = str(Path(attrs["directory"]) / filename)
+                utils._savescriptsource(f, filepath)
 
     # def _process_stdout(self, child):
     #     atoms = 0
@@ -1,25 +1,35 @@
+import contextlib
 import functools
 import inspect
 import os
-import random
 import sys
 import warnings
+import zlib
 from pathlib import Path
 
 import h5py
+import numpy as np
 from termcolor import colored
 
 
 def search_lammps_executables(full_path=True):
     """Find executables in PATH matching the pattern 'lmp*'."""
     matches = []
-    pattern = "lmp*"
+    prefix = "lmp"
     paths = os.environ.get("PATH", "").split(os.pathsep)
     for path in paths:
-        path = Path(path)
-        for exe in path.glob(pattern):
-            print(f"Found {exe}")
-            matches.append(exe)
+        if not path:
+            continue
+        # a single directory listing per path without a stat for every entry
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith(prefix) and entry.is_file():
+                        exe = Path(entry.path)
+                        print(f"Found {exe}")
+                        matches.append(exe)
+        except OSError:
+            continue
     if full_path:
         return matches
     else:
@@ -60,30 +70,77 @@ def validate_id(func):
     return wrapper
 
 
+def _stable_repr(arg):
+    # a repr that does not depend on memory addresses or numpy's print
+    # options so the same arguments always give the same uid
+    if isinstance(arg, dict):
+        items = sorted(
+            (repr(k), _stable_repr(v))
+            for k, v in arg.items()
+            if not str(k).startswith("_")
+        )
+        return "{" + ", ".join(f"{k}: {v}" for k, v in items) + "}"
+    if isinstance(arg, (list, tuple)):
+        return "[" + ", ".join(_stable_repr(item) for item in arg) + "]"
+    if isinstance(arg, np.ndarray):
+        data = np.ascontiguousarray(arg).tobytes()
+        return f"ndarray({arg.dtype}, {arg.shape}, {zlib.crc32(data):08x})"
+    if callable(arg) and hasattr(arg, "__qualname__"):
+        return f"{arg.__module__}.{arg.__qualname__}"
+    return repr(arg)
+
+
 def _unique_id(*args):
-    # extract 2 least significant bytes. that should be enough to make sure ids
-    # are unique and it's sensitive to small changes in the input arguments
-    uid = sum([id(arg) + random.randint(1, 2**16) for arg in args])
-    # uid &= 0xFFF
-    return uid
+    # hash the arguments so that ids are reproducible between runs but still
+    # sensitive to small changes in the input arguments
+    return zlib.crc32(_stable_repr(args).encode())
+
+
+@contextlib.contextmanager
+def _h5open(h5file, mode="a"):
+    # reuse already open h5 files so that callers can batch several writes
+    # in a single open/close cycle
+    if isinstance(h5file, h5py.Group):
+        yield h5file
+    else:
+        with h5py.File(h5file, mode, libver="latest") as f:
+            yield f
 
 
 def _savescriptsource(h5file, script):
-    with h5py.File(h5file, "a") as f:
-        with open(script, "rb") as pf:
-            lines = pf.readlines()
-            f.create_dataset(script, data=lines)
+    # store the whole file as a single compressed byte array rather than a
+    # variable length string per line
+    with open(script, "rb") as pf:
+        data = np.frombuffer(pf.read(), dtype="u1")
+
+    with _h5open(h5file) as f:
+        if data.size:
+            f.create_dataset(
+                script, data=data, compression="gzip", compression_opts=4, shuffle=True
+            )
+        else:
+            f.create_dataset(script, data=data)
+
+
+def _loadscriptsource(h5file, script):
+    with _h5open(h5file, "r") as f:
+        return f[script][()].tobytes()
 
 
 def _savecallersource(h5file):
-    # inspect the first four frames of the stack to find the correct
+    # inspect the first few frames of the stack to find the correct
     # filename. This covers calling from execute() or _writeinputfile().
     # if the stack is indeed larger than this it's probably the REPL.
-    stack = inspect.stack()[:5]
-    for frame in stack:
-        if sys.argv[0] == frame.filename:
-            _savescriptsource(h5file, frame.filename)
+    # walk the frames directly since inspect.stack() reads the source of
+    # every frame which is slow and not needed here
+    frame = sys._getframe(1)
+    for _ in range(5):
+        if frame is None:
+            break
+        if sys.argv[0] == frame.f_code.co_filename:
+            _savescriptsource(h5file, frame.f_code.co_filename)
             return
+        frame = frame.f_back
 
     # cannot save on the h5 file if using the repl
     warnings.warn(
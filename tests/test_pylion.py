@@ -1,9 +1,17 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import h5py
 import pytest
+
 import pylion as pl
+from pylion import utils
 from pylion.pylion import SimulationError
 
 
-@pytest.mark.skip(reason="UIDs are now random by default")
 def test_unique_id(cleanup):
     s = pl.Simulation("test")
 
@@ -23,6 +31,32 @@ def test_unique_id(cleanup):
         s._writeinputfile()
 
 
+def test_unique_id_kwargs():
+    first = pl.dump("positions.txt", variables=["x", "y", "z"])
+    second = pl.dump("positions.txt", variables=["vx", "vy", "vz"])
+    assert first["uid"] != second["uid"]
+    assert pl.dump("positions.txt", variables=["x", "y", "z"])["uid"] == first["uid"]
+
+
+def test_same_species(cleanup):
+    s = pl.Simulation("test")
+    ions = {"charge": 1, "mass": 40}
+
+    # two groups of the same species are still separate species
+    first = pl.createioncloud(ions, 1e-4, 5)
+    second = pl.createioncloud(ions, 2e-4, 5)
+    assert first["uid"] != second["uid"]
+
+    # the same definition keeps its uid
+    positions = [[0, 0, 0], [1e-5, 0, 0]]
+    uid = pl.placeions(ions, positions)["uid"]
+    assert pl.placeions(ions, positions)["uid"] == uid
+
+    first["uid"], second["uid"] = 1, 2
+    s.extend([first, second])
+    s._writeinputfile()
+
+
 def test_noatoms(cleanup):
     s = pl.Simulation("test")
 
@@ -54,6 +88,22 @@ def test_sameuids(cleanup):
         s._writeinputfile()
 
 
+def test_particles_in_domain():
+    domain = [1e-3, 1e-3, 2e-3]
+    positions = [[0, 0, 0], [-0.9e-3, 0.9e-3, 1.9e-3]]
+    assert pl.check_particles_in_domain(positions, domain)
+
+    positions.append([0, 0, -2e-3])
+    assert not pl.check_particles_in_domain(positions, domain)
+
+    # empty species are trivially in the domain
+    assert pl.check_particles_in_domain([], domain)
+
+    # malformed positions are not reshaped into something that passes
+    with pytest.raises(ValueError, match="shape"):
+        pl.check_particles_in_domain([[0, 0], [0, 0], [0, 0]], domain)
+
+
 def test_returnsdict():
     @pl.lammps.fix
     def fixme(uid):
@@ -123,6 +173,18 @@ def test_contains(cleanup):
     assert efield in s
 
 
+def test_index(cleanup):
+    s = pl.Simulation("test")
+    s.append(pl.evolve(10))
+    efield = pl.efield(1, 1, 1)
+    s.append(efield)
+
+    assert s.index(efield) == 1
+
+    with pytest.raises(ValueError):
+        s.index({"uid": -1})
+
+
 def test_rigid(cleanup):
     s = pl.Simulation("test")
     ions = pl.createioncloud({"charge": 3, "mass": 10}, 1e-3, 10)
@@ -149,3 +211,122 @@ def test_missing_executable():
     s.attrs["executable"] = "non_existing_executable"
     with pytest.raises(SimulationError, match="Could not find executable"):
         s.execute()
+
+
+def test_output_files(cleanup):
+    s = pl.Simulation("test")
+    ions = pl.createioncloud({"charge": 1, "mass": 10}, 1e-4, 10)
+    ions["uid"] = 1
+    s.append(ions)
+    s.append(pl.dump("positions.txt", variables=["x", "y", "z"]))
+
+    # custom fixes without an 'output_files' key are parsed for dumps
+    code = ["dump 123 all custom 10 velocities.txt id vx vy vz"]
+    s.append({"code": code, "type": "fix", "uid": 123})
+    s._writeinputfile()
+
+    assert s.attrs["output_files"] == ["positions.txt", "velocities.txt"]
+
+
+def test_domain_check_rewrite(cleanup):
+    s = pl.Simulation("test")
+    ions = pl.placeions({"charge": 1, "mass": 10}, [[0, 0, 0]])
+    ions["uid"] = 1
+    s.append(ions)
+    s._writeinputfile()
+
+    # positions edited in place have to be checked again
+    ions["positions"] += 1.0
+    with pytest.raises(SimulationError, match="outside the simulation domain"):
+        s._writeinputfile()
+
+    # and so do new positions
+    ions["positions"] = [[0, 0, 1]]
+    with pytest.raises(SimulationError, match="outside the simulation domain"):
+        s._writeinputfile()
+
+
+def test_save_attributes_and_files(cleanup):
+    s = pl.Simulation("test")
+    ions = pl.placeions({"charge": 1, "mass": 10}, [[0, 0, 0]])
+    ions["uid"] = 1
+    s.append(ions)
+    s._writeinputfile()
+    Path(s.attrs["directory"], "test.lmp.log").write_text("Created 1 atoms\n")
+
+    with pytest.warns(UserWarning, match="Caller source not saved"):
+        s._save_attributes_and_files()
+
+    h5file = Path(s.attrs["directory"], "test.h5")
+    attrs = s.attrs.load(h5file)
+    assert attrs["name"] == "test"
+    assert attrs["domain"] == s.attrs["domain"]
+
+    logfile = str(Path(s.attrs["directory"], "test.lmp.log"))
+    assert utils._loadscriptsource(h5file, logfile) == b"Created 1 atoms\n"
+
+
+def test_search_lammps_executables(tmp_path, monkeypatch):
+    (tmp_path / "lmp_serial").touch()
+    (tmp_path / "notlmp").touch()
+    (tmp_path / "lmp_dir").mkdir()
+    path = os.pathsep.join([str(tmp_path), str(tmp_path / "missing"), ""])
+    monkeypatch.setenv("PATH", path)
+
+    assert utils.search_lammps_executables() == [tmp_path / "lmp_serial"]
+    assert utils.search_lammps_executables(full_path=False) == ["lmp_serial"]
+
+
+def test_attributes_load_legacy(tmp_path):
+    h5file = tmp_path / "legacy.h5"
+    with h5py.File(h5file, "w") as f:
+        f.attrs["name"] = json.dumps("legacy")
+        f.attrs["domain"] = json.dumps([1, 2, 3])
+
+    attrs = pl.Attributes().load(h5file)
+    assert attrs == {"name": "legacy", "domain": [1, 2, 3]}
+
+
+def test_unusable_bytecode_cache(tmp_path):
+    # a cache folder that is not a directory owned by the user is unsafe
+    # and jinja2 refuses to use it
+    (tmp_path / f"_jinja2-cache-{os.getuid()}").touch()
+    env = {**os.environ, "TMPDIR": str(tmp_path)}
+    code = "import pylion.pylion as p; print(p._JINJA_ENV.bytecode_cache)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "None"
+
+
+def test_ions_not_modified_by_write(cleanup):
+    s = pl.Simulation("test")
+    ions = pl.placeions({"charge": 1, "mass": 10}, [[0, 0, 0]])
+    ions["uid"] = 1
+    s.append(ions)
+    keys = set(ions)
+    s._writeinputfile()
+
+    assert set(ions) == keys
+    script = Path(s.attrs["directory"], "test.lammps").read_text()
+    assert "create_atoms 1 single 0.0 0.0 0.0 units box" in script
+
+
+def test_failed_write_keeps_script(cleanup):
+    s = pl.Simulation("test")
+    ions = pl.placeions({"charge": 1, "mass": 10}, [[0, 0, 0]])
+    ions["uid"] = 1
+    s.append(ions)
+    s._writeinputfile()
+    filepath = Path(s.attrs["directory"], "test.lammps")
+    script = filepath.read_text()
+
+    # rendering fails half way through the template
+    s.append({"code": 1, "type": "command"})
+    with pytest.raises(TypeError):
+        s._writeinputfile()
+
+    assert filepath.read_text() == script
+    assert list(Path(s.attrs["directory"]).iterdir()) == [filepath]